@@ -1,131 +1,327 @@
-import os
-from typing import List, Dict
-import numpy as np
-from collections import defaultdict
-import jieba
-
-class SimpleKnowledgeBase:
-    def __init__(self):
-        self.documents = []
-        self.index = defaultdict(list)
-        
-    def add_documents(self, documents: List[Dict[str, str]]):
-        """
-        添加文档到知识库
-        documents: [{"content": "文档内容", "source": "来源", "category": "分类"}]
-        """
-        for doc in documents:
-            doc_id = len(self.documents)
-            self.documents.append(doc)
-            
-            # 对文档内容分词并建立倒排索引
-            words = jieba.lcut(doc["content"])
-            for word in set(words):  # 使用set去重
-                self.index[word].append(doc_id)
-    
-    def search(self, query: str, n_results: int = 5) -> List[Dict]:
-        """
-        搜索相关文档
-        使用简单的词频匹配
-        """
-        # 对查询分词
-        query_words = set(jieba.lcut(query))
-        
-        # 统计每个文档匹配的词数
-        doc_scores = defaultdict(int)
-        for word in query_words:
-            for doc_id in self.index.get(word, []):
-                doc_scores[doc_id] += 1
-        
-        # 按匹配度排序
-        sorted_docs = sorted(
-            doc_scores.items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:n_results]
-        
-        # 返回结果
-        results = []
-        for doc_id, score in sorted_docs:
-            doc = self.documents[doc_id].copy()
-            doc["score"] = score
-            results.append(doc)
-        
-        return results
-    
-    def get_relevant_knowledge(self, bazi_data: dict) -> str:
-        """
-        根据八字信息获取相关的命理知识
-        """
-        # 构建查询
-        query = f"""
-        {bazi_data['year']}年柱 
-        {bazi_data['month']}月柱 
-        {bazi_data['day']}日柱 
-        {bazi_data['hour']}时柱 
-        命理分析 五行 运势
-        """
-        
-        # 搜索相关文档
-        results = self.search(query)
-        
-        # 合并文档内容
-        knowledge = "\n\n".join([
-            f"来源：{doc['source']}\n"
-            f"分类：{doc['category']}\n"
-            f"相关度：{doc['score']}\n"
-            f"内容：{doc['content']}"
-            for doc in results
-        ])
-        
-        return knowledge
-
-# 初始化示例数据
-def initialize_knowledge_base():
-    kb = SimpleKnowledgeBase()
-    
-    # 添加示例命理知识
-    sample_documents = [
-        {
-            "content": """
-            五行基础知识：
-            金：代表秋天，与肺、大肠相对应，性质坚强刚毅
-            木：代表春天，与肝、胆相对应，性质生发向上
-            水：代表冬天，与肾、膀胱相对应，性质智慧灵活
-            火：代表夏天，与心、小肠相对应，性质温暖光明
-            土：代表季节交替，与脾、胃相对应，性质厚重包容
-            """,
-            "source": "五行理论",
-            "category": "基础知识"
-        },
-        {
-            "content": """
-            天干地支组合规则：
-            甲子、乙丑、丙寅、丁卯、戊辰、己巳、庚午、辛未、壬申、癸酉
-            天干：甲乙属木、丙丁属火、戊己属土、庚辛属金、壬癸属水
-            地支：子属水、丑属土、寅属木、卯属木、辰属土、巳属火
-            午属火、未属土、申属金、酉属金、戌属土、亥属水
-            """,
-            "source": "命理基础",
-            "category": "基础知识"
-        },
-        {
-            "content": """
-            八字命理分析方法：
-            1. 日主强弱：以日干为中心，分析天干地支的五行关系
-            2. 喜忌判断：根据日主强弱，判断五行补泻关系
-            3. 格局分析：根据八字组合特征，判断命局格局
-            4. 运势分析：通过大运、流年与原局关系判断运势
-            5. 吉凶断定：综合以上因素，得出吉凶断语
-            """,
-            "source": "命理分析方法",
-            "category": "分析技巧"
-        }
-    ]
-    
-    kb.add_documents(sample_documents)
-    return kb
-
-if __name__ == "__main__":
-    # 初始化知识库
-    initialize_knowledge_base() 
\ No newline at end of file
+import hashlib
+import pickle
+from pathlib import Path
+from typing import List, Dict, Tuple
+import numpy as np
+from functools import lru_cache
+
+from config import KB_INDEX_PATH
+
+try:
+    # jieba_fast是jieba的C扩展重实现，接口完全兼容，分词速度提升数倍；
+    # 未安装时回退到纯Python的jieba
+    import jieba_fast as jieba
+except ImportError:
+    import jieba
+
+try:
+    from numba import njit
+except ImportError:  # numba不可用时退化为纯Python实现
+    njit = None
+
+# BM25参数（Okapi标准默认值）
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def _score_kernel(query_ids, query_idf, postings, offsets, tf,
+                  doc_len, avgdl, out):
+    """
+    BM25打分核心循环
+    对每个查询词，沿其倒排拉链按Okapi公式把得分累加到对应文档；
+    文档长度归一化修正了TF-IDF对长文档的偏置
+    """
+    for i in range(len(query_ids)):
+        term_id = query_ids[i]
+        idf = query_idf[i]
+        for p in range(offsets[term_id], offsets[term_id + 1]):
+            doc_id = postings[p]
+            f = tf[p]
+            out[doc_id] += idf * f * (BM25_K1 + 1.0) / (
+                f + BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len[doc_id] / avgdl)
+            )
+
+if njit is not None:
+    # 编译为紧凑的C循环，并缓存编译结果供后续进程复用
+    _score_kernel = njit(cache=True, fastmath=True)(_score_kernel)
+
+def _documents_hash(documents: List[Dict[str, str]]) -> str:
+    """文档集合的内容哈希，用作持久化索引的失效判据"""
+    h = hashlib.sha1()
+    for doc in documents:
+        h.update(doc["content"].encode())
+        h.update(doc.get("source", "").encode())
+        h.update(doc.get("category", "").encode())
+    return h.hexdigest()
+
+# 导入时即加载jieba词典，避免首个请求承担数百毫秒的懒加载开销
+jieba.initialize()
+
+@lru_cache(maxsize=8192)
+def _tokenize(text: str) -> Tuple[str, ...]:
+    """分词并缓存结果（过滤空白符词元），重复文本/查询跳过分词开销"""
+    return tuple(w for w in jieba.lcut(text) if w.strip())
+
+class SimpleKnowledgeBase:
+    def __init__(self):
+        self.documents = []
+        self.vocab: Dict[str, int] = {}
+        self.idf = None
+        # 词主序（term-major）的CSR倒排索引：
+        # 第t个词的倒排拉链为 postings[offsets[t]:offsets[t+1]]，
+        # tf为对应(词,文档)对的词频；doc_len/avgdl用于BM25长度归一化
+        self.postings = None
+        self.offsets = None
+        self.tf = None
+        self.doc_len = None
+        self.avgdl = 0.0
+        # 查询模板中不变的部分只分词一次
+        self._static_query_tokens = frozenset(
+            _tokenize("年柱 月柱 日柱 时柱 命理分析 五行 运势")
+        )
+
+    def add_documents(self, documents: List[Dict[str, str]]):
+        """
+        添加文档到知识库
+        documents: [{"content": "文档内容", "source": "来源", "category": "分类"}]
+        """
+        self.documents.extend(documents)
+        self._build_index()
+
+    def _build_index(self):
+        """
+        构建TF-IDF倒排索引
+        单次扫描收集全部(词, 文档)词元对，之后的去重、词频统计、
+        IDF加权和归一化全部在numpy的C层完成，不再逐词写Python字典
+        """
+        # 单次扫描收集词元流，文档id不逐词元展开成Python整数对象，
+        # 只记录每篇词元数，由np.repeat生成紧凑的int32数组
+        words, token_counts = [], []
+        for doc in self.documents:
+            tokens = _tokenize(doc["content"])
+            words.extend(tokens)
+            token_counts.append(len(tokens))
+
+        if not words:
+            return
+
+        n_docs = len(self.documents)
+        doc_ids = np.repeat(np.arange(n_docs, dtype=np.int32), token_counts)
+
+        # np.unique一次性得到有序词表和每个词元的词id
+        uniq_words, term_ids = np.unique(np.asarray(words), return_inverse=True)
+        n_words = len(uniq_words)
+
+        # 按(词id, 文档id)排序后做游程统计，得到每个(词,文档)对的词频
+        order = np.lexsort((doc_ids, term_ids))
+        terms_sorted = term_ids[order]
+        docs_sorted = doc_ids[order]
+        is_new_pair = np.ones(len(order), dtype=bool)
+        is_new_pair[1:] = (
+            (terms_sorted[1:] != terms_sorted[:-1])
+            | (docs_sorted[1:] != docs_sorted[:-1])
+        )
+        starts = np.flatnonzero(is_new_pair)
+        tf = np.diff(np.append(starts, len(order))).astype(np.float64)
+        posting_docs = docs_sorted[starts]
+        posting_terms = terms_sorted[starts]
+
+        # 文档频率 -> Okapi IDF，常见词（如"命理"）被降权
+        df = np.bincount(posting_terms, minlength=n_words)
+        idf = np.log((n_docs - df + 0.5) / (df + 0.5) + 1)
+
+        # 文档长度与平均长度，供BM25做长度归一化
+        doc_len = np.bincount(posting_docs, weights=tf, minlength=n_docs)
+
+        # 倒排数组已按词id有序，searchsorted直接给出各拉链边界
+        self.vocab = {word: i for i, word in enumerate(uniq_words)}
+        self.idf = idf
+        self.postings = posting_docs.astype(np.int32)
+        self.offsets = np.searchsorted(
+            posting_terms, np.arange(n_words + 1)
+        ).astype(np.int32)
+        self.tf = tf.astype(np.float32)
+        self.doc_len = doc_len.astype(np.float32)
+        self.avgdl = float(doc_len.mean())
+
+    def search(self, query: str, n_results: int = 5) -> List[Dict]:
+        """
+        搜索相关文档
+        使用Okapi BM25打分排序
+        """
+        return self._search_tokens(_tokenize(query), n_results)
+
+    def _search_tokens(self, tokens, n_results: int = 5) -> List[Dict]:
+        """
+        按已分词的词元序列搜索，供调用方跳过查询侧分词
+        """
+        if self.postings is None or not self.vocab:
+            return []
+
+        # 收集词表内的查询词及其IDF（Okapi对短查询忽略查询侧词频）
+        query_ids, query_idf = [], []
+        for word in set(tokens):
+            word_id = self.vocab.get(word)
+            if word_id is not None:
+                query_ids.append(word_id)
+                query_idf.append(self.idf[word_id])
+
+        # 查询词全部不在词表中时直接返回空
+        if not query_ids:
+            return []
+
+        # JIT编译的核心循环沿倒排拉链累加BM25得分
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        _score_kernel(
+            np.asarray(query_ids, dtype=np.int32),
+            np.asarray(query_idf, dtype=np.float32),
+            self.postings,
+            self.offsets,
+            self.tf,
+            self.doc_len,
+            self.avgdl,
+            scores,
+        )
+
+        # argpartition取top-k后再排序
+        n_results = min(n_results, len(scores))
+        top = np.argpartition(-scores, n_results - 1)[:n_results]
+        top = top[np.argsort(-scores[top])]
+
+        # 返回结果
+        results = []
+        for doc_id in top:
+            if scores[doc_id] <= 0:
+                continue
+            doc = self.documents[doc_id].copy()
+            doc["score"] = round(float(scores[doc_id]), 4)
+            results.append(doc)
+
+        return results
+
+    def save_index(self, path: str = KB_INDEX_PATH):
+        """把构建好的索引数组落盘，供下次启动直接加载"""
+        if self.postings is None:
+            return
+        np.savez(
+            path,
+            postings=self.postings,
+            offsets=self.offsets,
+            tf=self.tf,
+            doc_len=self.doc_len,
+            avgdl=self.avgdl,
+            idf=self.idf,
+        )
+        with open(f"{path}.meta", "wb") as f:
+            pickle.dump(
+                {"hash": _documents_hash(self.documents), "vocab": self.vocab}, f
+            )
+
+    def load_index(self, documents: List[Dict[str, str]],
+                   path: str = KB_INDEX_PATH) -> bool:
+        """
+        尝试从磁盘加载索引，成功返回True
+        文档内容哈希不匹配（语料有变化）或文件缺失/损坏时返回False，
+        由调用方重新构建；加载现成数组跳过了重新分词与建索引，
+        启动开销只剩读文件本身
+        """
+        meta_path = Path(f"{path}.meta")
+        if not (Path(path).exists() and meta_path.exists()):
+            return False
+        try:
+            with open(meta_path, "rb") as f:
+                meta = pickle.load(f)
+            if meta["hash"] != _documents_hash(documents):
+                return False
+            data = np.load(path)
+            self.documents = list(documents)
+            self.vocab = meta["vocab"]
+            self.idf = data["idf"]
+            self.postings = data["postings"]
+            self.offsets = data["offsets"]
+            self.tf = data["tf"]
+            self.doc_len = data["doc_len"]
+            self.avgdl = float(data["avgdl"])
+            return True
+        except Exception:
+            return False
+
+    def get_relevant_knowledge(self, bazi_data: dict) -> str:
+        """
+        根据八字信息获取相关的命理知识
+        """
+        # 四柱干支是已知的双字组合，直接取整柱及其单字作为词元，
+        # 与预分词的静态词元合并，免去每次请求的jieba调用
+        tokens = set(self._static_query_tokens)
+        for pillar in (bazi_data['year'], bazi_data['month'],
+                       bazi_data['day'], bazi_data['hour']):
+            tokens.add(pillar)
+            tokens.update(pillar)
+
+        # 搜索相关文档
+        results = self._search_tokens(tokens)
+
+        # 合并文档内容
+        knowledge = "\n\n".join([
+            f"来源：{doc['source']}\n"
+            f"分类：{doc['category']}\n"
+            f"相关度：{doc['score']}\n"
+            f"内容：{doc['content']}"
+            for doc in results
+        ])
+
+        return knowledge
+
+# 初始化示例数据
+def initialize_knowledge_base():
+    kb = SimpleKnowledgeBase()
+
+    # 添加示例命理知识
+    sample_documents = [
+        {
+            "content": """
+            五行基础知识：
+            金：代表秋天，与肺、大肠相对应，性质坚强刚毅
+            木：代表春天，与肝、胆相对应，性质生发向上
+            水：代表冬天，与肾、膀胱相对应，性质智慧灵活
+            火：代表夏天，与心、小肠相对应，性质温暖光明
+            土：代表季节交替，与脾、胃相对应，性质厚重包容
+            """,
+            "source": "五行理论",
+            "category": "基础知识"
+        },
+        {
+            "content": """
+            天干地支组合规则：
+            甲子、乙丑、丙寅、丁卯、戊辰、己巳、庚午、辛未、壬申、癸酉
+            天干：甲乙属木、丙丁属火、戊己属土、庚辛属金、壬癸属水
+            地支：子属水、丑属土、寅属木、卯属木、辰属土、巳属火
+            午属火、未属土、申属金、酉属金、戌属土、亥属水
+            """,
+            "source": "命理基础",
+            "category": "基础知识"
+        },
+        {
+            "content": """
+            八字命理分析方法：
+            1. 日主强弱：以日干为中心，分析天干地支的五行关系
+            2. 喜忌判断：根据日主强弱，判断五行补泻关系
+            3. 格局分析：根据八字组合特征，判断命局格局
+            4. 运势分析：通过大运、流年与原局关系判断运势
+            5. 吉凶断定：综合以上因素，得出吉凶断语
+            """,
+            "source": "命理分析方法",
+            "category": "分析技巧"
+        }
+    ]
+
+    # 优先加载磁盘上的持久化索引，语料未变时跳过重新分词与构建
+    if kb.load_index(sample_documents):
+        return kb
+
+    kb.add_documents(sample_documents)
+    kb.save_index()
+    return kb
+
+if __name__ == "__main__":
+    # 初始化知识库
+    initialize_knowledge_base()
\ No newline at end of file
@@ -1,23 +1,35 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator
 from datetime import datetime, time
 import os
-import requests
+import math
+import time as _time
+import asyncio
+import hashlib
+import sqlite3
+import httpx
+import orjson
+
+try:
+    from numba import njit
+except ImportError:  # numba不可用时保留纯Python实现
+    njit = None
 from dotenv import load_dotenv
+from functools import lru_cache
 from typing import Optional
 import logging
-from api.knowledge_base import SimpleKnowledgeBase, initialize_knowledge_base
+from api.knowledge_base import initialize_knowledge_base
 from lunar_python import Lunar, Solar
-from datetime import datetime, timedelta
-import math
 from config import (
     DEEPSEEK_API_KEY,
     DEEPSEEK_MODEL,
     DEEPSEEK_TIMEOUT,
     DEEPSEEK_TEMPERATURE,
     FRONTEND_PORT,
-    BAZI_ANALYSIS_PROMPT
+    BAZI_ANALYSIS_PROMPT,
+    ANALYSIS_CACHE_PATH
 )
 
 # 配置日志
@@ -27,7 +39,37 @@ logger = logging.getLogger(__name__)
 # 加载环境变量
 load_dotenv()
 
-app = FastAPI()
+# orjson序列化响应，长文本分析结果的编码开销约为stdlib json的1/3
+app = FastAPI(default_response_class=ORJSONResponse)
+
+DEEPSEEK_CHAT_URL = "https://api.deepseek.com/v1/chat/completions"
+
+@app.on_event("startup")
+async def _init_http_client():
+    # 模块级异步客户端：复用连接池，避免每次请求重建TCP/TLS连接，
+    # 也不再让同步requests调用阻塞事件循环
+    app.state.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(DEEPSEEK_TIMEOUT),
+        limits=httpx.Limits(max_connections=50),
+    )
+
+@app.on_event("shutdown")
+async def _close_http_client():
+    await app.state.http.aclose()
+
+@app.on_event("startup")
+async def _warm_search_kernel():
+    # 首次搜索会触发Numba编译（1-2秒量级），启动时先跑一次查询，
+    # 让编译在第一个真实请求到来前完成；配合njit(cache=True)，
+    # 后续进程可直接复用磁盘上的编译产物。
+    # 预热词必须真的在词表里，否则search在进打分核心前就提前返回、
+    # 什么也没编译——"五行"在示例语料中且jieba会切出该词
+    if kb is not None:
+        warmed = kb.search("五行", n_results=1)
+        if not warmed:
+            # 预热词没进词表说明打分核心没被执行，首个真实请求会
+            # 承担编译开销；只告警不阻断启动
+            logger.warning("搜索预热未命中任何文档，打分核心未被提前编译")
 
 # 配置CORS
 app.add_middleware(
@@ -46,21 +88,106 @@ except Exception as e:
     logger.error(f"知识库初始化失败: {str(e)}")
     kb = None
 
+# 分析结果磁盘缓存
+# 分析输入归结为(四柱, 性别)，命中缓存时毫秒级返回，完全跳过DeepSeek调用；
+# 键中混入模型名和提示词版本，模型或提示词变更时旧缓存自动失效
+_PROMPT_VERSION = hashlib.sha1(BAZI_ANALYSIS_PROMPT.encode()).hexdigest()[:8]
+
+def _init_analysis_cache():
+    conn = sqlite3.connect(ANALYSIS_CACHE_PATH, check_same_thread=False)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS analyses "
+        "(key TEXT PRIMARY KEY, response TEXT, created_at INT)"
+    )
+    conn.commit()
+    return conn
+
+try:
+    _analysis_cache = _init_analysis_cache()
+    logger.info("分析缓存初始化成功")
+except Exception as e:
+    logger.error(f"分析缓存初始化失败: {str(e)}")
+    _analysis_cache = None
+
+def _analysis_cache_key(bazi: dict, gender: str) -> str:
+    raw = (
+        f"{bazi['year']}|{bazi['month']}|{bazi['day']}|{bazi['hour']}"
+        f"|{gender}|{DEEPSEEK_MODEL}|{_PROMPT_VERSION}"
+    )
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def _get_cached_analysis(key: str) -> Optional[str]:
+    if _analysis_cache is None:
+        return None
+    row = _analysis_cache.execute(
+        "SELECT response FROM analyses WHERE key = ?", (key,)
+    ).fetchone()
+    return row[0] if row else None
+
+def _store_analysis(key: str, analysis: str):
+    if _analysis_cache is None:
+        return
+    _analysis_cache.execute(
+        "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?)",
+        (key, analysis, int(datetime.now().timestamp()))
+    )
+    _analysis_cache.commit()
+
+@lru_cache(maxsize=1024)
+def _relevant_knowledge(year_gz: str, month_gz: str, day_gz: str, hour_gz: str) -> str:
+    """按四柱缓存知识库检索结果"""
+    return kb.get_relevant_knowledge({
+        "year": year_gz, "month": month_gz, "day": day_gz, "hour": hour_gz
+    })
+
+@lru_cache(maxsize=1)
+def _this_year_cached(day_bucket: int) -> int:
+    return datetime.now().year
+
+def _current_year() -> int:
+    """当前年份，按天刷新
+
+    校验上界不再每次请求构造datetime取系统时间；
+    以epoch天数为缓存键，跨年后长期运行的进程也能自动更新
+    """
+    return _this_year_cached(int(_time.time()) // 86400)
+
 class BirthInfo(BaseModel):
-    year: int
-    month: int
-    day: int
+    # 取值范围由Pydantic在解析时强制，处理函数内无需再做运行时检查
+    year: int = Field(..., ge=1900, description="出生年份，1900年至今")
+    month: int = Field(..., ge=1, le=12, description="出生月份")
+    day: int = Field(..., ge=1, le=31, description="出生日期")
     birth_time: time = Field(..., description="出生时间，格式为 HH:MM")
-    latitude: float = Field(..., description="出生地纬度")
-    longitude: float = Field(..., description="出生地经度")
+    latitude: float = Field(..., ge=-90, le=90, description="出生地纬度")
+    longitude: float = Field(..., ge=-180, le=180, description="出生地经度")
     is_lunar: bool = False
     gender: str = Field(..., description="性别，'男'或'女'")
 
+    @field_validator("year")
+    @classmethod
+    def _year_not_in_future(cls, v: int) -> int:
+        if v > _current_year():
+            raise ValueError("年份必须在1900年至今之间")
+        return v
+
 # 天干
 HEAVENLY_STEMS = ["甲", "乙", "丙", "丁", "戊", "己", "庚", "辛", "壬", "癸"]
 # 地支
 EARTHLY_BRANCHES = ["子", "丑", "寅", "卯", "辰", "巳", "午", "未", "申", "酉", "戌", "亥"]
 
+# 天干 -> 序号 的O(1)查找表
+STEM_INDEX = {stem: i for i, stem in enumerate(HEAVENLY_STEMS)}
+
+# 时柱干支表：HOUR_GZ_TABLE[日干序号][时辰地支序号]
+# 全部60种组合在模块加载时生成，请求路径上不再拼接字符串
+HOUR_GZ_TABLE = tuple(
+    tuple(
+        f"{HEAVENLY_STEMS[(day_stem * 2 + branch) % 10]}{EARTHLY_BRANCHES[branch]}"
+        for branch in range(12)
+    )
+    for day_stem in range(10)
+)
+
 def convert_lunar_to_solar(year: int, month: int, day: int) -> tuple:
     """将农历日期转换为公历日期"""
     try:
@@ -71,75 +198,34 @@ def convert_lunar_to_solar(year: int, month: int, day: int) -> tuple:
         logger.error(f"农历转换失败: {str(e)}")
         raise ValueError(f"农历日期转换失败: {str(e)}")
 
-def beijing_time_to_local_time(dt: datetime, longitude: float) -> datetime:
-    """将北京时间转换为当地时间
-    
-    Args:
-        dt: 北京时间
-        longitude: 当地经度（东经为正，西经为负）
-    
-    Returns:
-        当地时间
+# 北京经度
+BEIJING_LONGITUDE = 116.4074
+
+def _local_hm(hour: int, minute: int, longitude: float):
+    """将北京时间的时分换算为当地时间的时分
+
+    每经度对应4分钟时差，全部折算成一天内的分钟数做整数运算，
+    不再构造datetime/timedelta对象
+    """
+    total = hour * 60.0 + minute + (longitude - BEIJING_LONGITUDE) * 4.0
+    total = math.floor(total) % 1440
+    return total // 60, total % 60
+
+if njit is not None:
+    _local_hm = njit(cache=True)(_local_hm)
+
+def get_gz_hour(hour: int, minute: int = 0) -> int:
+    """根据当地时间获取时辰的地支序号
+
+    每个时辰占两小时，子时(0)跨越23:00-01:00，
+    因此序号即 (小时+1)//2 对12取模，无需区间查表
     """
-    # 北京经度
-    BEIJING_LONGITUDE = 116.4074
-    
-    # 计算经度差（当地经度 - 北京经度）
-    longitude_diff = longitude - BEIJING_LONGITUDE
-    
-    # 计算时差（分钟）：每经度4分钟
-    time_diff_minutes = longitude_diff * 4
-    
-    # 调整时间
-    local_time = dt + timedelta(minutes=time_diff_minutes)
-    return local_time
-
-def get_gz_hour(hour: int, minute: int) -> tuple:
-    """根据当地时间获取时辰的干支"""
-    # 将小时和分钟转换为小时的小数形式
-    decimal_hour = hour + minute / 60.0
-    
-    # 12时辰对应的时间范围（使用小数形式的小时）
-    hour_ranges = {
-        0: (23, 1),    # 子时 (23:00-01:00)
-        1: (1, 3),     # 丑时 (01:00-03:00)
-        2: (3, 5),     # 寅时 (03:00-05:00)
-        3: (5, 7),     # 卯时 (05:00-07:00)
-        4: (7, 9),     # 辰时 (07:00-09:00)
-        5: (9, 11),    # 巳时 (09:00-11:00)
-        6: (11, 13),   # 午时 (11:00-13:00)
-        7: (13, 15),   # 未时 (13:00-15:00)
-        8: (15, 17),   # 申时 (15:00-17:00)
-        9: (17, 19),   # 酉时 (17:00-19:00)
-        10: (19, 21),  # 戌时 (19:00-21:00)
-        11: (21, 23)   # 亥时 (21:00-23:00)
-    }
-    
-    # 处理跨午夜的情况
-    if decimal_hour >= 23 or decimal_hour < 1:
-        return 0  # 子时
-    
-    # 确定时辰
-    for branch_index, (start, end) in hour_ranges.items():
-        if start <= decimal_hour < end:
-            return branch_index
-    
-    return 0  # 默认返回子时
+    return int((hour + minute / 60.0 + 1) // 2) % 12
 
 def calculate_bazi(birth_info: BirthInfo) -> dict:
     """计算八字"""
     try:
-        # 验证输入
-        if not (1900 <= birth_info.year <= datetime.now().year):
-            raise ValueError("年份必须在1900年至今之间")
-        if not (1 <= birth_info.month <= 12):
-            raise ValueError("月份必须在1-12之间")
-        if not (1 <= birth_info.day <= 31):
-            raise ValueError("日期必须在1-31之间")
-        if not (-90 <= birth_info.latitude <= 90):
-            raise ValueError("纬度必须在-90到90度之间")
-        if not (-180 <= birth_info.longitude <= 180):
-            raise ValueError("经度必须在-180到180度之间")
+        # 取值范围已由BirthInfo的字段约束在解析时保证
 
         # 如果是农历，转换为公历
         year, month, day = (
@@ -148,24 +234,18 @@ def calculate_bazi(birth_info: BirthInfo) -> dict:
             else (birth_info.year, birth_info.month, birth_info.day)
         )
 
-        # 创建北京时间datetime对象
-        beijing_datetime = datetime(
-            year, month, day,
+        # 校验日期是否为合法公历日期（lunar-python不校验）
+        datetime(year, month, day)
+
+        # 转换为当地时间的时分（纯整数运算）
+        local_hour, local_minute = _local_hm(
             birth_info.birth_time.hour,
-            birth_info.birth_time.minute
-        )
-        
-        # 转换为当地时间
-        local_datetime = beijing_time_to_local_time(
-            beijing_datetime,
+            birth_info.birth_time.minute,
             birth_info.longitude
         )
-        
+
         # 获取当地时间的时辰
-        hour_branch_index = get_gz_hour(
-            local_datetime.hour,
-            local_datetime.minute
-        )
+        hour_branch_index = get_gz_hour(local_hour, local_minute)
 
         # 使用lunar-python计算八字
         solar = Solar.fromYmd(year, month, day)
@@ -176,10 +256,9 @@ def calculate_bazi(birth_info: BirthInfo) -> dict:
         month_gz = lunar.getMonthInGanZhi()
         day_gz = lunar.getDayInGanZhi()
         
-        # 计算时柱干支
-        day_stem_index = HEAVENLY_STEMS.index(day_gz[0])  # 获取日干索引
-        hour_stem_index = (day_stem_index * 2 + hour_branch_index) % 10
-        hour_gz = f"{HEAVENLY_STEMS[hour_stem_index]}{EARTHLY_BRANCHES[hour_branch_index]}"
+        # 计算时柱干支（查预生成的60组合表）
+        day_stem_index = STEM_INDEX[day_gz[0]]
+        hour_gz = HOUR_GZ_TABLE[day_stem_index][hour_branch_index]
 
         logger.info(f"八字计算结果 - 年: {year_gz}, 月: {month_gz}, 日: {day_gz}, 时: {hour_gz}")
         
@@ -190,98 +269,186 @@ def calculate_bazi(birth_info: BirthInfo) -> dict:
             "hour": hour_gz,
             "solar_date": f"{year}年{month}月{day}日",
             "lunar_date": f"{lunar.getYearInChinese()}年{lunar.getMonthInChinese()}月{lunar.getDayInChinese()}",
-            "local_time": local_datetime.strftime("%H:%M")
+            "local_time": f"{local_hour:02d}:{local_minute:02d}"
         }
     except Exception as e:
         logger.error(f"八字计算错误: {str(e)}")
         raise HTTPException(status_code=400, detail=f"八字计算错误: {str(e)}")
 
+async def _prepare_analysis(birth_info: BirthInfo) -> tuple:
+    """计算八字、检索知识并生成缓存键（/analyze 与 /analyze/stream 共用）
+
+    八字计算与知识检索都是纯Python同步代码，放进线程池执行以免阻塞
+    事件循环；知识检索期间并行预热DeepSeek连接，把TLS握手移出关键路径
+    """
+    # 检查知识库状态
+    if kb is None:
+        raise HTTPException(status_code=500, detail="知识库未正确初始化")
+
+    loop = asyncio.get_running_loop()
+
+    # 计算八字（知识检索依赖其结果，需先完成）
+    bazi = await loop.run_in_executor(None, calculate_bazi, birth_info)
+    logger.info(f"八字计算结果: {bazi}")
+
+    cache_key = _analysis_cache_key(bazi, birth_info.gender)
+
+    # 知识检索与连接预热并行
+    knowledge_future = loop.run_in_executor(
+        None, _relevant_knowledge,
+        bazi['year'], bazi['month'], bazi['day'], bazi['hour']
+    )
+    # 只在确定要调用DeepSeek（缓存未命中）时才预热：
+    # 命中路径本应毫秒级返回，不能被一次外部往返拖住
+    if _get_cached_analysis(cache_key) is None:
+        try:
+            await app.state.http.get("https://api.deepseek.com/", timeout=2)
+        except httpx.HTTPError:
+            pass  # 预热失败不影响主流程
+
+    # 获取相关命理知识
+    try:
+        knowledge = await knowledge_future
+        logger.info("成功获取命理知识")
+    except Exception as e:
+        logger.error(f"获取命理知识失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"获取命理知识失败: {str(e)}")
+
+    return bazi, knowledge, cache_key
+
+def _build_prompt(bazi: dict, gender: str, knowledge: str) -> str:
+    """构建提示词"""
+    if not DEEPSEEK_API_KEY:
+        logger.error("DeepSeek API key未配置")
+        raise HTTPException(status_code=500, detail="DeepSeek API key not configured")
+
+    return BAZI_ANALYSIS_PROMPT.format(
+        year=bazi['year'],
+        month=bazi['month'],
+        day=bazi['day'],
+        hour=bazi['hour'],
+        solar_date=bazi['solar_date'],
+        lunar_date=bazi['lunar_date'],
+        gender=gender,
+        knowledge=knowledge
+    )
+
+async def _deepseek_stream(prompt: str):
+    """以流式方式调用DeepSeek API，逐段产出生成的内容"""
+    try:
+        logger.info("开始调用DeepSeek API...")
+        async with app.state.http.stream(
+            "POST",
+            DEEPSEEK_CHAT_URL,
+            headers={
+                "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": DEEPSEEK_MODEL,
+                "messages": [
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": DEEPSEEK_TEMPERATURE,
+                "stream": True
+            },
+        ) as response:
+            if response.status_code != 200:
+                text = (await response.aread()).decode("utf-8", errors="replace")
+                logger.error(f"DeepSeek API请求失败: {text}")
+                raise HTTPException(status_code=500, detail=f"DeepSeek API请求失败: {text}")
+
+            # 解析SSE流，生成一段产出一段
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                content = orjson.loads(data)["choices"][0]["delta"].get("content")
+                if content:
+                    yield content
+        logger.info("成功获取分析结果")
+
+    except httpx.TimeoutException:
+        logger.error(f"DeepSeek API请求超时（{DEEPSEEK_TIMEOUT}秒）")
+        raise HTTPException(
+            status_code=504,
+            detail=f"DeepSeek API请求超时（{DEEPSEEK_TIMEOUT}秒），请稍后重试"
+        )
+    except httpx.HTTPError as e:
+        logger.error(f"调用DeepSeek API时发生错误: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"调用DeepSeek API时发生错误: {str(e)}")
+
 @app.post("/analyze")
 async def analyze_bazi(birth_info: BirthInfo):
     try:
         logger.info(f"收到请求: {birth_info}")
-        
-        # 检查知识库状态
-        if kb is None:
-            raise HTTPException(status_code=500, detail="知识库未正确初始化")
-        
-        # 计算八字
-        bazi = calculate_bazi(birth_info)
-        logger.info(f"八字计算结果: {bazi}")
-        
-        # 获取相关命理知识
-        try:
-            knowledge = kb.get_relevant_knowledge(bazi)
-            logger.info("成功获取命理知识")
-        except Exception as e:
-            logger.error(f"获取命理知识失败: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"获取命理知识失败: {str(e)}")
-        
-        # 使用配置的API密钥
-        if not DEEPSEEK_API_KEY:
-            logger.error("DeepSeek API key未配置")
-            raise HTTPException(status_code=500, detail="DeepSeek API key not configured")
-        
-        # 构建提示词
-        prompt = BAZI_ANALYSIS_PROMPT.format(
-            year=bazi['year'],
-            month=bazi['month'],
-            day=bazi['day'],
-            hour=bazi['hour'],
-            solar_date=bazi['solar_date'],
-            lunar_date=bazi['lunar_date'],
-            gender=birth_info.gender,
-            knowledge=knowledge
-        )
-        
-        try:
-            logger.info("开始调用DeepSeek API...")
-            # 调用DeepSeek API
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": DEEPSEEK_MODEL,
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": DEEPSEEK_TEMPERATURE
-                },
-                timeout=DEEPSEEK_TIMEOUT
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"DeepSeek API请求失败: {response.text}")
-                raise HTTPException(status_code=500, detail=f"DeepSeek API请求失败: {response.text}")
-            
-            analysis = response.json()["choices"][0]["message"]["content"]
-            logger.info("成功获取分析结果")
-            
-        except requests.exceptions.Timeout:
-            logger.error(f"DeepSeek API请求超时（{DEEPSEEK_TIMEOUT}秒）")
-            raise HTTPException(
-                status_code=504,
-                detail=f"DeepSeek API请求超时（{DEEPSEEK_TIMEOUT}秒），请稍后重试"
-            )
-        except requests.exceptions.RequestException as e:
-            logger.error(f"调用DeepSeek API时发生错误: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"调用DeepSeek API时发生错误: {str(e)}")
-        
+
+        bazi, knowledge, cache_key = await _prepare_analysis(birth_info)
+
+        # 先查分析缓存，命中则跳过DeepSeek调用
+        analysis = _get_cached_analysis(cache_key)
+        if analysis is not None:
+            logger.info("命中分析缓存，跳过DeepSeek调用")
+        else:
+            prompt = _build_prompt(bazi, birth_info.gender, knowledge)
+            chunks = []
+            async for content in _deepseek_stream(prompt):
+                chunks.append(content)
+            analysis = "".join(chunks)
+
+            # 写回缓存，后续相同命盘直接复用
+            _store_analysis(cache_key, analysis)
+
         return {
             "bazi": bazi,
             "analysis": analysis,
             "knowledge_base": knowledge
         }
-        
+
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"处理请求时发生错误: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理请求时发生错误: {str(e)}")
 
+@app.post("/analyze/stream")
+async def analyze_bazi_stream(birth_info: BirthInfo):
+    """流式分析接口：先推送八字与知识，再逐段推送分析内容（SSE）"""
+    logger.info(f"收到流式请求: {birth_info}")
+
+    bazi, knowledge, cache_key = await _prepare_analysis(birth_info)
+    cached = _get_cached_analysis(cache_key)
+    if cached is None:
+        prompt = _build_prompt(bazi, birth_info.gender, knowledge)
+
+    async def event_stream():
+        meta = {"type": "bazi", "bazi": bazi, "knowledge_base": knowledge}
+        yield b"data: " + orjson.dumps(meta) + b"\n\n"
+
+        if cached is not None:
+            logger.info("命中分析缓存，跳过DeepSeek调用")
+            delta = {"type": "delta", "content": cached}
+            yield b"data: " + orjson.dumps(delta) + b"\n\n"
+        else:
+            chunks = []
+            try:
+                async for content in _deepseek_stream(prompt):
+                    chunks.append(content)
+                    delta = {"type": "delta", "content": content}
+                    yield b"data: " + orjson.dumps(delta) + b"\n\n"
+            except HTTPException as e:
+                # 响应已经开始，错误只能以事件形式下发
+                err = {"type": "error", "detail": e.detail}
+                yield b"data: " + orjson.dumps(err) + b"\n\n"
+                return
+            _store_analysis(cache_key, "".join(chunks))
+
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/health")
 async def health_check():
     """健康检查接口"""
@@ -13,6 +13,12 @@ DEEPSEEK_TEMPERATURE = float(os.getenv("DEEPSEEK_TEMPERATURE", "0.7"))
 # API 超时设置
 API_TIMEOUT = int(os.getenv("API_TIMEOUT", "180"))
 
+# 分析结果缓存文件路径
+ANALYSIS_CACHE_PATH = os.getenv("ANALYSIS_CACHE_PATH", "analysis_cache.db")
+
+# 知识库索引持久化路径
+KB_INDEX_PATH = os.getenv("KB_INDEX_PATH", "kb_index.npz")
+
 # 服务器配置
 API_HOST = os.getenv("API_HOST", "127.0.0.1")
 API_PORT = int(os.getenv("API_PORT", "8000"))
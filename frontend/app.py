@@ -1,7 +1,10 @@
 import streamlit as st
 import requests
+import httpx
 from datetime import datetime, time
+import time as _time
 import json
+import pandas as pd
 from config import API_URL, API_TIMEOUT, DEBUG
 from frontend.city_data import CITY_DATA
 
@@ -11,20 +14,71 @@ st.set_page_config(
     layout="wide"
 )
 
+# 模块级Session：跨rerun复用keep-alive连接，免去每次交互的TCP/TLS握手
+_session = requests.Session()
+_adapter = requests.adapters.HTTPAdapter(
+    pool_connections=10, pool_maxsize=10, max_retries=3
+)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+_session.headers.update({"Content-Type": "application/json"})
+
+# 把嵌套的CITY_DATA在导入时摊平成SoA布局：选项列表直接是现成的元组，
+# 经纬度按(省,市)一次哈希查到，rerun时不再反复走两层字典再取字段
+_PROVINCES = tuple(CITY_DATA)
+_CITIES = {province: tuple(cities) for province, cities in CITY_DATA.items()}
+_LATLON = {
+    (province, city): (info["lat"], info["lon"])
+    for province, cities in CITY_DATA.items()
+    for city, info in cities.items()
+}
+
+# 健康检查结果的缓存时长（秒）
+_HEALTH_TTL = 15
+
 def check_api_health():
-    """检查API服务是否可用"""
+    """检查API服务是否可用
+
+    每次控件交互都会触发脚本rerun，成功结果在session_state中缓存15秒，
+    避免每次按键都打一个健康检查round trip。失败不缓存：每次rerun都
+    重新探测（2秒超时兜底）并重新显示错误提示，后端一恢复立即可用
+    """
+    now = _time.monotonic()
+    cached = st.session_state.get("_health_ok_at")
+    if cached is not None and now - cached < _HEALTH_TTL:
+        return True
+
+    ok = False
     try:
-        response = requests.get(f"{API_URL}/health")
+        response = _session.get(f"{API_URL}/health", timeout=2)
         if response.status_code == 200:
             data = response.json()
             if data.get("knowledge_base") != "initialized":
                 st.error("知识库未正确初始化，请联系管理员")
-                return False
-            return True
+            else:
+                ok = True
     except requests.exceptions.RequestException:
         st.error("无法连接到后端服务，请确保服务已启动")
-        return False
-    return False
+
+    if ok:
+        st.session_state["_health_ok_at"] = now
+    else:
+        st.session_state.pop("_health_ok_at", None)
+    return ok
+
+# 异常类型/状态码 -> 提示文案 的查找表，取代逐个except分支
+_ERRMSG = {
+    requests.exceptions.Timeout: (
+        f"请求超时（{API_TIMEOUT}秒），这可能是因为：\n"
+        "1. 服务器响应时间较长\n2. 网络连接不稳定\n\n请稍后重试。"
+    ),
+    requests.exceptions.ConnectionError: "无法连接到服务器，请确保服务已启动",
+}
+
+_STATUS_ERRMSG = {
+    400: "请求错误: {detail}",
+    504: "分析请求超时，这可能是因为服务器正在处理大量请求。请稍后重试。",
+}
 
 def call_api(endpoint: str, data: dict):
     """调用后端API的通用函数"""
@@ -34,44 +88,151 @@ def call_api(endpoint: str, data: dict):
         if DEBUG:
             st.write("Debug Info:")
             st.write(f"URL: {url}")
-            st.write(f"Request Data: {json.dumps(data, ensure_ascii=False, indent=2)}")
+            # st.json直接渲染字典，省去json.dumps整份序列化
+            st.write("Request Data:")
+            st.json(data)
         
-        response = requests.post(
+        # stream=True避免urllib3先把整个响应体读进内部缓冲再整体拷贝
+        response = _session.post(
             url,
             json=data,
-            headers={"Content-Type": "application/json"},
-            timeout=API_TIMEOUT
+            timeout=API_TIMEOUT,
+            stream=True
         )
         
+        # 响应体只解析一次，调试输出、错误分支与返回值共用
+        try:
+            parsed = response.json()
+        except ValueError:
+            parsed = None
+
         # 显示调试信息
         if DEBUG:
             st.write(f"Response Status: {response.status_code}")
             st.write(f"Response Headers: {dict(response.headers)}")
-            try:
-                st.write(f"Response Body: {json.dumps(response.json(), ensure_ascii=False, indent=2)}")
-            except:
+            if parsed is not None:
+                # st.json直接渲染解析好的字典，不再重新序列化成字符串
+                st.write("Response Body:")
+                st.json(parsed)
+            else:
                 st.write(f"Response Text: {response.text}")
-        
-        if response.status_code == 400:
-            error_msg = response.json().get("detail", "输入数据验证失败")
-            st.error(f"请求错误: {error_msg}")
-            return None
-        elif response.status_code == 504:
-            st.error("分析请求超时，这可能是因为服务器正在处理大量请求。请稍后重试。")
+
+        status_msg = _STATUS_ERRMSG.get(response.status_code)
+        if status_msg:
+            detail = (parsed or {}).get("detail", "输入数据验证失败")
+            st.error(status_msg.format(detail=detail))
             return None
-        
+
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.Timeout:
-        st.error(f"请求超时（{API_TIMEOUT}秒），这可能是因为：\n1. 服务器响应时间较长\n2. 网络连接不稳定\n\n请稍后重试。")
-    except requests.exceptions.ConnectionError:
-        st.error("无法连接到服务器，请确保服务已启动")
+        return parsed
     except requests.exceptions.RequestException as e:
-        st.error(f"API请求失败: {str(e)}")
+        # 沿MRO查表，子类异常（如ReadTimeout）也能命中对应文案
+        for exc_cls in type(e).__mro__:
+            if exc_cls in _ERRMSG:
+                st.error(_ERRMSG[exc_cls])
+                break
+        else:
+            st.error(f"API请求失败: {str(e)}")
     except Exception as e:
         st.error(f"发生错误: {str(e)}")
     return None
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_analyze(payload_json: str):
+    """按请求载荷缓存 /analyze 响应
+
+    相同出生信息的分析是确定性的，1小时内重复提交直接复用，
+    不再让后端重跑检索与LLM调用。失败时抛出RuntimeError而不是
+    返回None：异常不会被st.cache_data缓存，避免一次故障把该载荷
+    毒化整整1小时、后端恢复后也不再重试
+    """
+    result = call_api("/analyze", json.loads(payload_json))
+    if result is None:
+        raise RuntimeError("分析请求失败")
+    return result
+
+def _iter_sse(response):
+    """逐行解析SSE响应，产出反序列化后的事件"""
+    for line in response.iter_lines():
+        if not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            return
+        yield json.loads(payload)
+
+@st.cache_data
+def _result_tables(bazi_json: str):
+    """八字结果 -> DataFrame的纯变换，记忆化后rerun不再重建表格"""
+    bazi = json.loads(bazi_json)
+    date_info = pd.DataFrame({
+        "": ["日期", "当地时间"],
+        "公历": [bazi["solar_date"], bazi["local_time"]],
+        "农历": [bazi["lunar_date"], ""]
+    })
+    # 单字符用下标访问，切片会额外分配字符串
+    bazi_df = pd.DataFrame({
+        "": ["天干", "地支"],
+        "年柱": [bazi["year"][0], bazi["year"][1:]],
+        "月柱": [bazi["month"][0], bazi["month"][1:]],
+        "日柱": [bazi["day"][0], bazi["day"][1:]],
+        "时柱": [bazi["hour"][0], bazi["hour"][1:]]
+    })
+    return date_info, bazi_df
+
+def render_result_tables(bazi: dict):
+    """渲染日期信息与八字表格"""
+    date_info, bazi_df = _result_tables(json.dumps(bazi, sort_keys=True))
+
+    # st.dataframe走Arrow序列化增量渲染，比st.table生成的静态HTML轻量
+    st.write("### 日期信息")
+    st.dataframe(date_info, hide_index=True)
+
+    # 显示八字
+    st.write("### 您的八字")
+    st.dataframe(bazi_df, hide_index=True)
+
+def render_streaming_analysis(data: dict):
+    """流式调用 /analyze/stream 并增量渲染
+
+    首个事件包含八字与参考知识，先渲染表格；随后的内容增量
+    通过 st.write_stream 边生成边显示，感知延迟降到首个词元。
+    返回组装好的完整结果，连接失败时抛出 httpx.HTTPError，
+    服务端报告的分析错误以 RuntimeError 抛出
+    """
+    with httpx.stream(
+        "POST",
+        f"{API_URL}/analyze/stream",
+        json=data,
+        timeout=API_TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        events = _iter_sse(response)
+
+        # 首个事件是八字与知识元数据
+        meta = next(events, None)
+        if not meta or meta.get("type") != "bazi":
+            raise RuntimeError("流式响应格式异常")
+        render_result_tables(meta["bazi"])
+
+        # 逐段渲染分析内容
+        st.write("### 命理分析")
+
+        def _deltas():
+            for event in events:
+                if event.get("type") == "error":
+                    raise RuntimeError(event.get("detail", "分析失败"))
+                if event.get("type") == "delta":
+                    yield event.get("content", "")
+
+        analysis = st.write_stream(_deltas())
+
+        return {
+            "bazi": meta["bazi"],
+            "analysis": analysis,
+            "knowledge_base": meta["knowledge_base"]
+        }
+
 def main():
     st.title("生辰八字算命系统 🔮")
     st.write("请输入您的出生信息，我们将为您进行详细的命理分析。")
@@ -127,22 +288,19 @@ def main():
         # 省份选择
         province = st.selectbox(
             "选择省份",
-            options=list(CITY_DATA.keys()),
+            options=_PROVINCES,
             help="请选择您的出生地所在省份"
         )
-        
+
         # 城市选择（基于选择的省份）
-        cities = list(CITY_DATA[province].keys())
         city = st.selectbox(
             "选择城市",
-            options=cities,
+            options=_CITIES[province],
             help="请选择您的出生地所在城市"
         )
-        
+
         # 获取选中城市的经纬度
-        city_info = CITY_DATA[province][city]
-        latitude = city_info["lat"]
-        longitude = city_info["lon"]
+        latitude, longitude = _LATLON[(province, city)]
         
         # 显示选中地点的信息
         st.info(
@@ -152,54 +310,72 @@ def main():
         
         # 提交按钮
         if st.button("开始分析", type="primary"):
-            with st.spinner("正在分析中..."):
-                # 准备请求数据
-                data = {
-                    "year": birth_date.year,
-                    "month": birth_date.month,
-                    "day": birth_date.day,
-                    "birth_time": birth_time.strftime("%H:%M"),
-                    "latitude": latitude,
-                    "longitude": longitude,
-                    "is_lunar": is_lunar,
-                    "gender": gender
-                }
-                
-                # 调用API
-                result = call_api("/analyze", data)
-                
+            # 准备请求数据
+            data = {
+                "year": birth_date.year,
+                "month": birth_date.month,
+                "day": birth_date.day,
+                "birth_time": birth_time.strftime("%H:%M"),
+                "latitude": latitude,
+                "longitude": longitude,
+                "is_lunar": is_lunar,
+                "gender": gender
+            }
+
+            payload_json = json.dumps(data, sort_keys=True)
+
+            with col2:
+                st.subheader("分析结果")
+                result = st.session_state.get("_analyze_results", {}).get(payload_json)
+                if result is not None:
+                    # 相同载荷直接复用上次结果，不发起请求
+                    render_result_tables(result["bazi"])
+                    st.write("### 命理分析")
+                    st.write(result["analysis"])
+                else:
+                    # 流式输出渲染进可清空的占位容器：中途断流
+                    # （ReadTimeout等）时先整体清掉已渲染的表格和部分
+                    # 分析文本，回退路径才不会在残缺输出下方重复渲染
+                    stream_area = st.empty()
+                    try:
+                        # 优先走流式接口，边生成边渲染
+                        with stream_area.container():
+                            result = render_streaming_analysis(data)
+                    except httpx.HTTPError:
+                        stream_area.empty()
+                        # 流式接口不可用时回退到一次性JSON接口（带响应缓存）
+                        with st.spinner("正在分析中..."):
+                            try:
+                                result = _cached_analyze(payload_json)
+                            except RuntimeError:
+                                # 错误详情已由call_api展示，走下方的兜底逻辑
+                                result = None
+                        if result:
+                            render_result_tables(result["bazi"])
+                            st.write("### 命理分析")
+                            st.write(result["analysis"])
+                    except RuntimeError as e:
+                        stream_area.empty()
+                        st.error(f"分析失败: {str(e)}")
+
+                    if result:
+                        st.session_state.setdefault("_analyze_results", {})[payload_json] = result
+                        st.session_state["_last_result"] = (_time.time(), result)
+                    else:
+                        # 后端暂不可用时回退展示上次成功的结果（最长保留1天），
+                        # 避免一次抖动就让用户丢掉刚看过的分析
+                        stale = st.session_state.get("_last_result")
+                        if stale and _time.time() - stale[0] < 86400:
+                            st.warning("显示的是上次成功分析的结果（后端暂不可用）")
+                            result = stale[1]
+                            render_result_tables(result["bazi"])
+                            st.write("### 命理分析")
+                            st.write(result["analysis"])
+
                 if result:
-                    with col2:
-                        st.subheader("分析结果")
-                        
-                        # 显示日期信息
-                        st.write("### 日期信息")
-                        date_info = {
-                            "": ["日期", "当地时间"],
-                            "公历": [result["bazi"]["solar_date"], result["bazi"]["local_time"]],
-                            "农历": [result["bazi"]["lunar_date"], ""]
-                        }
-                        st.table(date_info)
-                        
-                        # 显示八字
-                        st.write("### 您的八字")
-                        bazi = result["bazi"]
-                        bazi_df = {
-                            "": ["天干", "地支"],
-                            "年柱": [bazi["year"][:1], bazi["year"][1:]],
-                            "月柱": [bazi["month"][:1], bazi["month"][1:]],
-                            "日柱": [bazi["day"][:1], bazi["day"][1:]],
-                            "时柱": [bazi["hour"][:1], bazi["hour"][1:]]
-                        }
-                        st.table(bazi_df)
-                        
-                        # 显示分析结果
-                        st.write("### 命理分析")
-                        st.write(result["analysis"])
-                        
-                        # 显示参考知识
-                        with st.expander("查看参考知识"):
-                            st.write(result["knowledge_base"])
+                    # 显示参考知识
+                    with st.expander("查看参考知识"):
+                        st.write(result["knowledge_base"])
 
     # 添加页脚
     st.markdown("---")
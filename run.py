@@ -2,16 +2,23 @@ import subprocess
 import sys
 import os
 import time
+from importlib.util import find_spec
 import requests
 from requests.exceptions import RequestException
 from config import API_HOST, API_PORT, FRONTEND_PORT
 
-def wait_for_api(url: str, max_retries: int = 30, delay: float = 1.0):
-    """等待API服务可用"""
+def wait_for_api(url: str, max_retries: int = 30, delay: float = 0.1):
+    """等待API服务可用
+
+    指数退避探测（0.1s起步，2s封顶）：后端通常亚秒级就绪，
+    固定1秒轮询平均会浪费约半个周期的启动时间
+    """
     print(f"等待API服务启动 ({url})...")
+    # 复用同一连接轮询，不再每次探测都新开TCP连接
+    session = requests.Session()
     for i in range(max_retries):
         try:
-            response = requests.get(url)
+            response = session.get(url, timeout=1)
             if response.status_code == 200:
                 print("API服务已就绪！")
                 return True
@@ -19,17 +26,15 @@ def wait_for_api(url: str, max_retries: int = 30, delay: float = 1.0):
             pass
         print(f"等待中... ({i + 1}/{max_retries})")
         time.sleep(delay)
+        delay = min(delay * 2, 2.0)
     print("API服务启动超时！")
     return False
 
 def main():
     # 检查是否安装了所需的依赖
-    try:
-        import fastapi
-        import streamlit
-        import jieba
-        import numpy
-    except ImportError:
+    # find_spec只查元数据不实际导入，省去streamlit/numpy数百毫秒的导入开销
+    needed = ("fastapi", "streamlit", "jieba", "numpy")
+    if not all(find_spec(module) for module in needed):
         print("正在安装依赖...")
         subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", "requirements.txt"])
     
@@ -40,19 +45,22 @@ def main():
         env=os.environ.copy()
     )
     
-    # 等待后端服务启动
-    if not wait_for_api(f"http://{API_HOST}:{API_PORT}/docs"):
-        print("无法启动后端服务，请检查日志！")
-        backend_process.terminate()
-        return
-    
     print("启动前端服务...")
-    # 启动前端服务
+    # 立即启动前端：Streamlit自身要1-3秒才能起来，与后端就绪探测重叠；
+    # 后端未就绪期间前端的健康检查会显示友好提示并在rerun时重试
     frontend_process = subprocess.Popen(
         [sys.executable, "-m", "streamlit", "run", "frontend/app.py", "--server.port", str(FRONTEND_PORT), "--server.address", API_HOST],
         env=os.environ.copy()
     )
-    
+
+    # 等待后端服务启动
+    # 探测轻量的/health接口，避免每次轮询都让后端渲染Swagger页面
+    if not wait_for_api(f"http://{API_HOST}:{API_PORT}/health"):
+        print("无法启动后端服务，请检查日志！")
+        backend_process.terminate()
+        frontend_process.terminate()
+        return
+
     try:
         # 等待任意一个进程结束
         backend_process.wait()